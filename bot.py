@@ -1,22 +1,56 @@
 """Discord bot for downloading and hosting Steam share videos."""
 import discord
 from discord import app_commands
+import aiohttp
 import asyncio
-import re
-from typing import Optional
+import logging
+import os
+import time
+import uvloop
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from config import config
-from downloader import downloader, DownloadError
+from config import config, log_handler
+from downloader import downloader, create_download_socket, DownloadError
+import web_server
 
 
+logger = logging.getLogger('clipbot.bot')
+
 # Discord server ID for guild sync (speeds up slash command registration)
 GUILD_ID = 691496387564798004
 
-# Steam share link pattern
-STEAM_LINK_PATTERN = re.compile(r'^https://cdn\.steamusercontent\.com/ugc/[^\s]+$')
+# Recently downloaded URLs are reused instead of downloaded again
+RECENT_DOWNLOAD_TTL = 3600  # seconds
+RECENT_DOWNLOAD_MAX = 512
+
+# Minimum time (seconds) between presence updates sent to the gateway
+STATUS_UPDATE_INTERVAL = 5.0
+
+# Upper bound (seconds) on the queue worker's retry delay after unexpected errors
+QUEUE_ERROR_BACKOFF_MAX = 60.0
+
+# Ephemeral acknowledgements sent by /share
+ACK_WORKING = "Working on your clip! Hang tight, it'll be ready soon."
+ACK_QUEUED_FMT = "You're in line! {n} clips ahead of you.".format
+ACK_QUEUE_FULL = "Queue full, try again later."
+
+# Steam share link prefix; links are validated with plain string ops, not a regex
+STEAM_LINK_PREFIX = 'https://cdn.steamusercontent.com/ugc/'
+
+
+def is_steam_link(url: str) -> bool:
+    """Check that a (stripped) URL is a Steam share link with no whitespace."""
+    return (
+        url.startswith(STEAM_LINK_PREFIX)
+        and len(url) > len(STEAM_LINK_PREFIX)
+        # A stripped string splits into one piece iff it has no inner whitespace;
+        # str.split scans in C instead of a per-character Python generator
+        and len(url.split(None, 1)) == 1
+    )
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class DownloadRequest:
     """Represents a download request from Discord."""
     url: str
@@ -40,20 +74,80 @@ class SteamClipBot(discord.Client):
         # Tree for slash commands
         self.tree = app_commands.CommandTree(self)
 
-        # Download queue for sequential processing
-        self.download_queue: asyncio.Queue[DownloadRequest] = asyncio.Queue()
-        self.queue_processor_task: Optional[asyncio.Task] = None
-        self.processing_count: bool = False  # Track if a video is currently being processed
+        # Download queue drained by a pool of concurrent workers
+        # The queue is bounded so bursts are turned away instead of piling up
+        # interactions that would expire before they are processed
+        self.download_queue: asyncio.Queue[DownloadRequest] = asyncio.Queue(maxsize=config.max_queue_size)
+        self.max_concurrent_downloads = config.max_concurrent_downloads
+        self.worker_tasks: List[asyncio.Task] = []
+        self.processing_count: int = 0  # Number of videos currently being processed
+
+        # Bound once so the per-download path avoids module-global lookups
+        self._base_url = config.base_url
+        self._downloader = downloader
+
+        # Shared HTTP session for clip downloads, created in setup_hook
+        self._http_session: Optional[aiohttp.ClientSession] = None
+
+        # Downloads shared between requests for the same URL
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._recent_downloads: Dict[str, Tuple[float, str, str]] = {}  # url -> (expires_at, filename, full_path)
         
         # Flag to prevent commands running before fully ready
         self.is_ready_for_commands = False
 
+        # Last (processing, queued) state sent to Discord, used to skip redundant presence updates
+        self._last_state: Tuple[int, int] = (0, -1)
+
+        # Activity objects reused across presence updates, keyed by their text
+        self._activity_cache: Dict[str, discord.Activity] = {}
+
+        # Presence updates are coalesced: callers mark the status dirty and a single
+        # background task pushes at most one update per STATUS_UPDATE_INTERVAL
+        self._status_dirty = asyncio.Event()
+        self._status_task: Optional[asyncio.Task] = None
+
     async def setup_hook(self):
         """Called when the bot is starting up, before on_ready."""
+        # Size the default executor to the worker pool instead of the stock
+        # min(32, cpu + 4) threads. Downloads stream on the event loop; the
+        # executor only runs their aiofiles open/write/close hops and the
+        # yt-dlp fallback. Each worker has at most one of those in flight at a
+        # time, so one thread per worker suffices. DNS doesn't need spares:
+        # aiohttp resolves through aiodns, and uvloop's getaddrinfo uses
+        # libuv's own thread pool.
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(
+                max_workers=self.max_concurrent_downloads,
+                thread_name_prefix="clip-dl"
+            )
+        )
+
         # Sync commands in the background to prevent blocking startup
         # This ensures the bot connects to the gateway immediately to handle interactions
         self.loop.create_task(self._sync_commands_background())
 
+        # Start the coalescing presence updater
+        self._status_task = asyncio.create_task(self._status_loop())
+
+        # One session for the bot's lifetime; keep-alive connections to the CDN
+        # are reused across downloads so each clip skips the TLS handshake
+        self._http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_concurrent_downloads,
+                limit_per_host=self.max_concurrent_downloads,
+                keepalive_timeout=60,
+                socket_factory=create_download_socket
+            ),
+            timeout=aiohttp.ClientTimeout(sock_connect=30, sock_read=60)
+        )
+
+    async def close(self):
+        """Close the download session along with the Discord connection."""
+        if self._http_session is not None:
+            await self._http_session.close()
+        await super().close()
+
     async def _sync_commands_background(self):
         """Syncs slash commands in the background."""
         await self.wait_until_ready() # Wait for connection before syncing
@@ -61,121 +155,208 @@ class SteamClipBot(discord.Client):
             guild = discord.Object(id=GUILD_ID)
             self.tree.copy_global_to(guild=guild)
             await self.tree.sync(guild=guild)
-            print(f'✓ Slash commands synced instantly to guild {GUILD_ID}')
+            logger.info('✓ Slash commands synced instantly to guild %s', GUILD_ID)
         except Exception as e:
-            print(f"✗ Failed to sync commands: {e}")
+            logger.error("✗ Failed to sync commands: %s", e)
 
     async def on_ready(self):
         """Called when the bot successfully connects to Discord."""
-        print(f'✓ Bot logged in as {self.user}')
-        print(f'  Connected to {len(self.guilds)} server(s)')
+        logger.info('✓ Bot logged in as %s', self.user)
+        logger.info('  Connected to %s server(s)', len(self.guilds))
 
-        # Start the queue processor if not running
-        if self.queue_processor_task is None:
-            self.queue_processor_task = asyncio.create_task(self._process_queue())
-            print('✓ Download queue processor started')
+        # Start the queue workers if not running
+        if not self.worker_tasks:
+            self.worker_tasks = [
+                asyncio.create_task(self._process_queue())
+                for _ in range(self.max_concurrent_downloads)
+            ]
+            logger.info('✓ Download queue processor started with %s worker(s)', len(self.worker_tasks))
 
         # Mark bot as ready to accept commands
         self.is_ready_for_commands = True
         
+        # A fresh IDENTIFY resets the gateway presence to the constructor's
+        # "Initializing..." one, so forget what was last sent and resend it
+        self._last_state = (0, -1)
+
         # Update status
-        await self._update_status()
+        self._update_status()
+
+    def _update_status(self):
+        """Request a presence refresh; the status loop applies it on its next turn."""
+        # Nothing observable changed since the last presence write
+        if (self.processing_count, self.download_queue.qsize()) == self._last_state:
+            return
+        self._status_dirty.set()
+
+    async def _status_loop(self):
+        """Apply pending presence updates, at most one every STATUS_UPDATE_INTERVAL seconds."""
+        while True:
+            await self._status_dirty.wait()
+            self._status_dirty.clear()
+            try:
+                await self._do_update_status()
+            except Exception as e:
+                logger.error("Error updating status: %s", e)
+            # Hold further writes so a burst of changes lands as one trailing update
+            await asyncio.sleep(STATUS_UPDATE_INTERVAL)
 
-    async def _update_status(self):
+    async def _do_update_status(self):
         """Update the bot's Discord status to show processing count."""
         # If the bot isn't fully ready, do not override the "Initializing" status
         if not self.is_ready_for_commands:
             return
 
+        processing = self.processing_count
         queue_size = self.download_queue.qsize()
-        total = (1 if self.processing_count else 0) + queue_size
+
+        # Skip the gateway write if the presence would not change
+        state = (processing, queue_size)
+        if state == self._last_state:
+            return
+
+        total = processing + queue_size
 
         if total == 0:
-            activity = discord.Activity(type=discord.ActivityType.watching, name="/share to get started")
-        elif self.processing_count:
+            name = "/share to get started"
+        elif processing:
             if queue_size > 0:
-                activity = discord.Activity(
-                    type=discord.ActivityType.watching,
-                    name=f"1 processing, {queue_size} queued"
-                )
+                name = f"{processing} processing, {queue_size} queued"
             else:
-                activity = discord.Activity(
-                    type=discord.ActivityType.watching,
-                    name="1 clip processing"
-                )
+                name = f"{processing} clip{'s' if processing != 1 else ''} processing"
         else:
-            activity = discord.Activity(
-                type=discord.ActivityType.watching,
-                name=f"{queue_size} clip{'s' if queue_size != 1 else ''} in queue"
-            )
+            name = f"{queue_size} clip{'s' if queue_size != 1 else ''} in queue"
+
+        activity = self._activity_cache.get(name)
+        if activity is None:
+            activity = discord.Activity(type=discord.ActivityType.watching, name=name)
+            self._activity_cache[name] = activity
 
         # Explicitly set status to Online here
         await self.change_presence(status=discord.Status.online, activity=activity)
+        self._last_state = state
+
+    async def _download(self, url: str) -> Tuple[str, str]:
+        """
+        Download a video, sharing work between requests for the same URL.
+
+        Concurrent requests for a URL await the one in-flight download, and
+        URLs downloaded within the last RECENT_DOWNLOAD_TTL seconds are served
+        from the existing file without hitting the network.
+
+        Returns:
+            Tuple of (filename, full_path)
+
+        Raises:
+            DownloadError: If download fails
+        """
+        now = time.monotonic()
+        cached = self._recent_downloads.get(url)
+        if cached is not None:
+            expires_at, filename, full_path = cached
+            if expires_at > now and os.path.exists(full_path):
+                logger.info("  Reusing recent download: %s", filename)
+                return filename, full_path
+            del self._recent_downloads[url]
+
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            logger.info("  Waiting on in-flight download of the same URL")
+            return await asyncio.shield(inflight)
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            result = await self._downloader.download_video_async(url, self._http_session)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                e = DownloadError("Download was cancelled")
+            future.set_exception(e)
+            future.exception()  # Mark retrieved so an unawaited failure isn't logged
+            raise
+        finally:
+            self._inflight.pop(url, None)
+
+        future.set_result(result)
+
+        # Remember the result, evicting the oldest entry when full
+        if len(self._recent_downloads) >= RECENT_DOWNLOAD_MAX:
+            del self._recent_downloads[next(iter(self._recent_downloads))]
+        self._recent_downloads[url] = (now + RECENT_DOWNLOAD_TTL, *result)
+
+        return result
 
     async def _process_queue(self):
-        """Process download requests from the queue sequentially."""
-        print("Queue processor ready. Waiting for requests...")
+        """Worker that processes download requests from the queue one at a time."""
+        logger.info("Queue processor ready. Waiting for requests...")
+
+        # Delay before retrying after an unexpected error, doubled on each
+        # consecutive failure up to QUEUE_ERROR_BACKOFF_MAX
+        backoff = 1.0
 
         while True:
             try:
                 # Wait for a request
                 request = await self.download_queue.get()
 
-                # Set processing flag
-                self.processing_count = True
-                await self._update_status()
+                # Track this worker as busy
+                self.processing_count += 1
+                self._update_status()
 
-                print(f"\nProcessing download request...")
-                print(f"  Processing: {self.processing_count}, Queue remaining: {self.download_queue.qsize()}")
+                logger.info("\nProcessing download request...")
+                logger.info("  Processing: %s, Queue remaining: %s", self.processing_count, self.download_queue.qsize())
 
                 try:
-                    # Download the video
-                    filename, full_path = await asyncio.to_thread(
-                        downloader.download_video,
-                        request.url
-                    )
+                    # Download the video (or reuse a recent/in-flight download)
+                    filename, full_path = await self._download(request.url)
 
-                    # Generate public URL
-                    public_url = f"{config.base_url}/{filename}"
-                    
-                    # Send the public result to the channel
+                    # Send the public result to the channel in a single REST call.
+                    # channel.send is used rather than a non-ephemeral followup because
+                    # interaction tokens expire after 15 minutes, which a long queue can exceed.
                     if request.interaction.channel:
                         await request.interaction.channel.send(
-                            f'{request.interaction.user.mention} sent a [clip]({public_url})'
+                            f'{request.interaction.user.mention} sent a [clip]({self._base_url}/{filename})'
                         )
 
-                    print(f"✓ Successfully processed: {filename}")
+                    logger.info("✓ Successfully processed: %s", filename)
 
                 except DownloadError as e:
                     await request.interaction.followup.send(
                         f'❌ Failed to download clip: {str(e)}',
                         ephemeral=True
                     )
-                    print(f"✗ Download failed: {str(e)}")
+                    logger.error("✗ Download failed: %s", e)
 
                 except Exception as e:
                     await request.interaction.followup.send(
                         f'❌ An unexpected error occurred: {str(e)}',
                         ephemeral=True
                     )
-                    print(f"✗ Unexpected error: {str(e)}")
+                    logger.error("✗ Unexpected error: %s", e)
 
                 finally:
-                    self.processing_count = False
-                    await self._update_status()
+                    self.processing_count -= 1
+                    self._update_status()
                     self.download_queue.task_done()
 
+                backoff = 1.0
+
             except asyncio.CancelledError:
-                print("Queue processor cancelled")
+                logger.info("Queue processor cancelled")
                 break
             except Exception as e:
-                print(f"Error in queue processor: {str(e)}")
-                await asyncio.sleep(1)
+                logger.error("Error in queue processor: %s", e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, QUEUE_ERROR_BACKOFF_MAX)
 
 
 def run_bot():
-    """Run the Discord bot."""
-    print("Starting Discord bot...")
+    """Run the Discord bot and the web server on one event loop."""
+    logger.info("Starting Discord bot...")
+
+    # Run discord.py (and the download session) on libuv's event loop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     bot = SteamClipBot()
 
     @bot.tree.command(name="share", description="Download and host a Steam share video")
@@ -188,14 +369,15 @@ def run_bot():
         try:
             await interaction.response.defer(ephemeral=True)
         except discord.NotFound:
-            print("Interaction not found (timed out before reaching bot)")
+            logger.warning("Interaction not found (timed out before reaching bot)")
             return
         except Exception as e:
-            print(f"Error deferring interaction: {e}")
+            logger.error("Error deferring interaction: %s", e)
             return
         
         # 2. Validate URL format
-        if not STEAM_LINK_PATTERN.match(url.strip()):
+        url = url.strip()
+        if not is_steam_link(url):
             # Use followup because we have already deferred
             await interaction.followup.send(
                 '❌ Invalid Steam share link. Please provide a valid link starting with `https://cdn.steamusercontent.com/ugc/`',
@@ -203,40 +385,44 @@ def run_bot():
             )
             return
 
-        print(f"\n[{interaction.guild.name if interaction.guild else 'DM'}] Steam link received from {interaction.user}")
-        print(f"  URL: {url}")
+        logger.info("\n[%s] Steam link received from %s", interaction.guild.name if interaction.guild else 'DM', interaction.user)
+        logger.info("  URL: %s", url)
 
         # 3. Add to Queue
         queue_size = bot.download_queue.qsize()
-        is_processing = bot.processing_count
-
-        request = DownloadRequest(url=url.strip(), interaction=interaction)
-        await bot.download_queue.put(request)
+        processing = bot.processing_count
+        all_workers_busy = processing >= bot.max_concurrent_downloads
 
-        # Update status (ignore errors if bot isn't fully ready)
+        request = DownloadRequest(url=url, interaction=interaction)
         try:
-            await bot._update_status()
-        except Exception:
-            pass
+            bot.download_queue.put_nowait(request)
+        except asyncio.QueueFull:
+            logger.warning("  Queue full, rejecting request")
+            await interaction.followup.send(ACK_QUEUE_FULL, ephemeral=True)
+            return
+
+        # Update status
+        bot._update_status()
 
         # 4. User Feedback
-        if is_processing and queue_size > 0:
-            await interaction.followup.send(
-                f"You're in line! {queue_size + 1} clips ahead of you.",
-                ephemeral=True
-            )
-        elif is_processing:
-            await interaction.followup.send(
-                "Working on your clip! Hang tight, it’ll be ready soon.",
-                ephemeral=True
-            )
+        if all_workers_busy and queue_size > 0:
+            message = ACK_QUEUED_FMT(n=queue_size + processing)
         else:
-            await interaction.followup.send(
-                "Working on your clip! Hang tight, it'll be ready soon.",
-                ephemeral=True
+            message = ACK_WORKING
+        await interaction.followup.send(message, ephemeral=True)
+
+    async def main():
+        # The bot and the web server share this process and event loop
+        async with bot:
+            await asyncio.gather(
+                bot.start(config.discord_bot_token),
+                web_server.serve()
             )
 
-    bot.run(config.discord_bot_token)
+    # bot.run() would normally install discord.py's stderr handler; use the
+    # queue handler instead so library logging doesn't write on the event loop
+    discord.utils.setup_logging(handler=log_handler)
+    asyncio.run(main())
 
 
 if __name__ == '__main__':
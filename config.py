@@ -1,11 +1,53 @@
 """Configuration management for the Discord bot."""
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
+import sys
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues records unformatted."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the message on the emitting thread so the
+        # record can be pickled. This queue is in-process, so the record is
+        # passed through as-is and the listener's handler formats it instead.
+        return record
+
+
+def _setup_logging() -> logging.handlers.QueueHandler:
+    """
+    Configure the 'clipbot' logger hierarchy.
+
+    Records are handed to a QueueHandler unformatted and are formatted and
+    written to stdout by a QueueListener thread, so neither %-formatting nor
+    I/O runs on the event loop. The handler is returned so third-party
+    loggers (discord.py, uvicorn) can be routed through the same queue.
+    """
+    log_queue: queue.Queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    atexit.register(listener.stop)
+
+    handler = _DeferredQueueHandler(log_queue)
+    root = logging.getLogger('clipbot')
+    root.setLevel(logging.INFO)
+    root.propagate = False
+    root.addHandler(handler)
+    return handler
+
+
+# Shared queue handler; attach other loggers to it rather than to a StreamHandler
+log_handler = _setup_logging()
+logger = logging.getLogger('clipbot')
+
+
 class Config:
     """Application configuration loaded from environment variables."""
     
@@ -14,6 +56,9 @@ class Config:
         self.base_url = os.getenv('BASE_URL', 'https://clips.ablomer.io')
         self.web_server_port = int(os.getenv('WEB_SERVER_PORT', '8080'))
         self.downloads_dir = os.getenv('DOWNLOADS_DIR', 'downloads')
+        self.max_concurrent_downloads = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '4'))
+        self.max_queue_size = int(os.getenv('MAX_QUEUE_SIZE', '50'))
+        self.download_socket_rcvbuf = int(os.getenv('DOWNLOAD_SOCKET_RCVBUF', '0'))
         
         # Validate required configuration
         self._validate()
@@ -25,11 +70,19 @@ class Config:
         
         if not self.base_url:
             raise ValueError("BASE_URL environment variable is required")
+
+        if self.max_concurrent_downloads < 1:
+            raise ValueError("MAX_CONCURRENT_DOWNLOADS must be at least 1")
+
+        if self.max_queue_size < 1:
+            raise ValueError("MAX_QUEUE_SIZE must be at least 1")
         
-        print(f"✓ Configuration loaded successfully")
-        print(f"  - Base URL: {self.base_url}")
-        print(f"  - Web Server Port: {self.web_server_port}")
-        print(f"  - Downloads Directory: {self.downloads_dir}")
+        logger.info("✓ Configuration loaded successfully")
+        logger.info("  - Base URL: %s", self.base_url)
+        logger.info("  - Web Server Port: %s", self.web_server_port)
+        logger.info("  - Downloads Directory: %s", self.downloads_dir)
+        logger.info("  - Max Concurrent Downloads: %s", self.max_concurrent_downloads)
+        logger.info("  - Max Queue Size: %s", self.max_queue_size)
 
 
 # Global config instance
@@ -1,12 +1,59 @@
-"""Video downloader using yt-dlp."""
+"""Video downloader using aiohttp for direct CDN files, with yt-dlp as a lazily imported fallback."""
+import asyncio
+import logging
 import os
+import socket
+import time
 import uuid
-import yt_dlp
+import aiofiles
+import aiohttp
 from pathlib import Path
 from typing import Optional, Tuple
+from urllib.parse import urlparse
 from config import config
 
 
+logger = logging.getLogger('clipbot.downloader')
+
+# Content types that can be saved straight to disk, mapped to file extensions
+DIRECT_VIDEO_TYPES = {
+    'video/mp4': 'mp4',
+    'video/webm': 'webm',
+    'video/x-matroska': 'mkv',
+    'video/x-msvideo': 'avi',
+    'video/quicktime': 'mov',
+    'video/x-flv': 'flv',
+}
+DIRECT_VIDEO_EXTENSIONS = set(DIRECT_VIDEO_TYPES.values())
+
+# Bytes buffered from the response before each disk write
+DOWNLOAD_WRITE_BATCH = 2 << 20
+
+# Downloads are written under this prefix and renamed into place when complete,
+# so the web server never sees (or serves) a partial file
+STAGING_PREFIX = '.tmp-'
+
+# Minimum time (seconds) between yt-dlp progress log lines
+PROGRESS_LOG_INTERVAL = 0.5
+
+
+def create_download_socket(addr_info) -> socket.socket:
+    """
+    Socket factory for the download session's TCPConnector.
+
+    Enables TCP_NODELAY and, when DOWNLOAD_SOCKET_RCVBUF is set, a larger
+    receive buffer so a single stream can fill a high bandwidth-delay path.
+    Setting SO_RCVBUF turns off Linux receive-buffer autotuning and is capped
+    by net.core.rmem_max, so it is left alone by default.
+    """
+    family, type_, proto, _, _ = addr_info
+    sock = socket.socket(family=family, type=type_, proto=proto)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if config.download_socket_rcvbuf > 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.download_socket_rcvbuf)
+    return sock
+
+
 class DownloadError(Exception):
     """Custom exception for download errors."""
     pass
@@ -32,35 +79,41 @@ class VideoDownloader:
         Raises:
             DownloadError: If download fails
         """
-        # Generate unique filename
-        unique_id = str(uuid.uuid4())
-        output_template = str(self.downloads_dir / f"{unique_id}.%(ext)s")
+        # Imported here because yt-dlp loads hundreds of extractor modules and is
+        # only needed when the direct aiohttp download can't handle the URL
+        import yt_dlp
+
+        # Generate unique filename, downloading under a staging name first
+        unique_id = uuid.uuid4().hex
+        output_template = str(self.downloads_dir / f"{STAGING_PREFIX}{unique_id}.%(ext)s")
         
         # Configure yt-dlp options
         ydl_opts = {
             'format': 'best',
             'outtmpl': output_template,
-            'quiet': False,
-            'no_warnings': False,
-            'progress_hooks': [self._progress_hook],
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'progress_hooks': [self._make_progress_hook()],
         }
         
         try:
-            print(f"Starting download: {url}")
+            logger.info("Starting download: %s", url)
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=True)
                 
                 # Get the actual filename that was used
                 if info:
-                    filename = ydl.prepare_filename(info)
-                    filename = os.path.basename(filename)
+                    staging_path = ydl.prepare_filename(info)
+                    filename = os.path.basename(staging_path)[len(STAGING_PREFIX):]
                     full_path = str(self.downloads_dir / filename)
                     
-                    if os.path.exists(full_path):
-                        print(f"✓ Download complete: {filename}")
+                    if os.path.exists(staging_path):
+                        os.replace(staging_path, full_path)
+                        logger.info("✓ Download complete: %s", filename)
                         return filename, full_path
                     else:
-                        raise DownloadError(f"Downloaded file not found: {full_path}")
+                        raise DownloadError(f"Downloaded file not found: {staging_path}")
                 else:
                     raise DownloadError("Failed to extract video information")
                     
@@ -69,17 +122,120 @@ class VideoDownloader:
         except Exception as e:
             raise DownloadError(f"Unexpected error during download: {str(e)}")
     
-    def _progress_hook(self, d):
-        """Hook to track download progress."""
-        if d['status'] == 'downloading':
-            if 'total_bytes' in d:
-                percent = d['downloaded_bytes'] / d['total_bytes'] * 100
-                print(f"  Progress: {percent:.1f}%", end='\r')
-            elif 'downloaded_bytes' in d:
-                mb = d['downloaded_bytes'] / (1024 * 1024)
-                print(f"  Downloaded: {mb:.1f} MB", end='\r')
-        elif d['status'] == 'finished':
-            print("\n  Finalizing download...")
+    async def download_video_async(self, url: str, session: aiohttp.ClientSession) -> Tuple[str, str]:
+        """
+        Download a video from the given URL on the event loop.
+
+        Direct video files are streamed to disk with the shared aiohttp
+        session. Anything else (e.g. a manifest or HTML page) is handed to
+        yt-dlp in the default executor.
+
+        Args:
+            url: The Steam share link URL
+            session: Shared aiohttp session used for the request
+
+        Returns:
+            Tuple of (filename, full_path)
+
+        Raises:
+            DownloadError: If download fails
+        """
+        staging_path = None
+        completed = False
+        try:
+            logger.info("Starting download: %s", url)
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    raise DownloadError(f"HTTP {resp.status} fetching {url}")
+
+                ext = self._direct_extension(url, resp.content_type)
+                if ext is None:
+                    logger.info("  Not a direct video (%s), falling back to yt-dlp", resp.content_type)
+                else:
+                    filename = f"{uuid.uuid4().hex}.{ext}"
+                    full_path = str(self.downloads_dir / filename)
+                    staging_path = str(self.downloads_dir / f"{STAGING_PREFIX}{filename}")
+
+                    # iter_any() hands over aiohttp's buffers as received instead of
+                    # re-slicing them into fixed-size chunks, and batching means each
+                    # aiofiles write (a thread hop plus a syscall) covers ~2 MiB
+                    async with aiofiles.open(staging_path, 'wb') as f:
+                        pending = []
+                        pending_size = 0
+                        async for chunk in resp.content.iter_any():
+                            pending.append(chunk)
+                            pending_size += len(chunk)
+                            if pending_size >= DOWNLOAD_WRITE_BATCH:
+                                await f.write(b''.join(pending))
+                                pending.clear()
+                                pending_size = 0
+                        if pending:
+                            await f.write(b''.join(pending))
+
+                    # Publish the finished file atomically
+                    os.replace(staging_path, full_path)
+                    completed = True
+                    logger.info("✓ Download complete: %s", filename)
+                    return filename, full_path
+
+        except DownloadError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DownloadError(f"HTTP download error: {str(e)}")
+        except Exception as e:
+            raise DownloadError(f"Unexpected error during download: {str(e)}")
+        finally:
+            # Also runs on cancellation, so no staging file is left behind
+            if not completed:
+                self._remove_partial(staging_path)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.download_video, url)
+
+    @staticmethod
+    def _direct_extension(url: str, content_type: str) -> Optional[str]:
+        """Pick a file extension for a direct video response, or None if it isn't one."""
+        ext = DIRECT_VIDEO_TYPES.get(content_type.lower())
+        if ext:
+            return ext
+
+        suffix = Path(urlparse(url).path).suffix.lower().lstrip('.')
+        if content_type.lower() == 'application/octet-stream' and suffix in DIRECT_VIDEO_EXTENSIONS:
+            return suffix
+
+        return None
+
+    @staticmethod
+    def _remove_partial(staging_path: Optional[str]):
+        """Delete a partially written download, if any."""
+        if staging_path and os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    @staticmethod
+    def _make_progress_hook():
+        """Build a progress hook for one download, with its own log throttle."""
+        last_logged = 0.0
+
+        def progress_hook(d):
+            """Hook to track download progress."""
+            nonlocal last_logged
+            if d['status'] == 'downloading':
+                # yt-dlp calls this for every chunk; log at most every PROGRESS_LOG_INTERVAL
+                now = time.monotonic()
+                if now - last_logged < PROGRESS_LOG_INTERVAL:
+                    return
+                last_logged = now
+
+                if 'total_bytes' in d:
+                    percent = d['downloaded_bytes'] / d['total_bytes'] * 100
+                    logger.info("  Progress: %.1f%%", percent)
+                elif 'downloaded_bytes' in d:
+                    mb = d['downloaded_bytes'] / (1024 * 1024)
+                    logger.info("  Downloaded: %.1f MB", mb)
+            elif d['status'] == 'finished':
+                logger.info("  Finalizing download...")
+
+        return progress_hook
 
 
 # Global downloader instance
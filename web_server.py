@@ -1,88 +1,150 @@
-"""Flask web server to host downloaded video files."""
+"""Starlette web server to host downloaded video files."""
+import asyncio
+import logging
 import os
-from flask import Flask, send_from_directory, jsonify
+import time
+import uvicorn
+import uvloop
 from pathlib import Path
-from config import config
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse
+from starlette.routing import Route
+from config import config, log_handler
 
 
-app = Flask(__name__)
+logger = logging.getLogger('clipbot.web')
 
+# How long (seconds) /health reuses a directory count before rescanning
+FILE_COUNT_TTL = 60
 
-@app.route('/')
-def index():
+# MIME types for served videos, keyed by file extension
+MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.mkv': 'video/x-matroska',
+    '.avi': 'video/x-msvideo',
+    '.mov': 'video/quicktime',
+    '.flv': 'video/x-flv',
+}
+
+# Downloads directory resolved once; serve_video only resolves the requested file
+DOWNLOADS_ROOT = Path(config.downloads_dir).resolve()
+DOWNLOADS_ROOT_PREFIX = str(DOWNLOADS_ROOT) + os.sep
+
+# Cached (expires_at, count) for the downloads directory
+_file_count_cache = (0.0, 0)
+
+
+def _cached_file_count(downloads_dir: Path) -> int:
+    """Count downloaded files, rescanning the directory at most every FILE_COUNT_TTL seconds."""
+    global _file_count_cache
+    now = time.monotonic()
+    expires_at, count = _file_count_cache
+    if now < expires_at:
+        return count
+
+    with os.scandir(downloads_dir) as entries:
+        count = sum(
+            1 for entry in entries
+            if entry.is_file() and '.' in entry.name and not entry.name.startswith('.')
+        )
+    _file_count_cache = (now + FILE_COUNT_TTL, count)
+    return count
+
+
+async def index(request: Request):
     """Health check endpoint."""
-    return jsonify({
+    return JSONResponse({
         'status': 'ok',
         'service': 'Steam Clip Bot File Server',
         'version': '1.0.0'
     })
 
 
-@app.route('/health')
-def health():
+async def health(request: Request):
     """Health check endpoint for monitoring."""
     downloads_dir = Path(config.downloads_dir)
-    return jsonify({
+    return JSONResponse({
         'status': 'healthy',
         'downloads_dir': str(downloads_dir),
         'downloads_dir_exists': downloads_dir.exists(),
-        'file_count': len(list(downloads_dir.glob('*.*'))) if downloads_dir.exists() else 0
+        'file_count': _cached_file_count(downloads_dir) if downloads_dir.exists() else 0
     })
 
 
-@app.route('/<filename>')
-def serve_video(filename):
+async def serve_video(request: Request):
     """
     Serve a video file from the downloads directory.
     
     Args:
-        filename: Name of the video file to serve
+        request: Request whose path holds the name of the video file to serve
         
     Returns:
         The video file with appropriate MIME type
     """
-    downloads_dir = Path(config.downloads_dir)
-    
-    # Security: Ensure the file exists and is within the downloads directory
-    file_path = downloads_dir / filename
-    
-    if not file_path.exists():
-        return jsonify({'error': 'File not found'}), 404
-    
-    # Verify the resolved path is still within downloads directory (prevent directory traversal)
-    try:
-        file_path.resolve().relative_to(downloads_dir.resolve())
-    except ValueError:
-        return jsonify({'error': 'Invalid file path'}), 403
+    filename = request.path_params['filename']
+
+    # Security: Reject separators and parent references before touching the filesystem
+    if '/' in filename or '\\' in filename or '..' in filename:
+        return JSONResponse({'error': 'Invalid file path'}, status_code=403)
+
+    file_path = DOWNLOADS_ROOT / filename
+
+    # Hidden names are in-progress downloads still being staged
+    if filename.startswith('.') or not file_path.exists():
+        return JSONResponse({'error': 'File not found'}, status_code=404)
+
+    # Verify the resolved path (e.g. through a symlink) is still within the
+    # downloads directory; only the file is resolved, the root was resolved at import
+    if not str(file_path.resolve()).startswith(DOWNLOADS_ROOT_PREFIX):
+        return JSONResponse({'error': 'Invalid file path'}, status_code=403)
     
     # Determine MIME type based on extension
     ext = file_path.suffix.lower()
-    mimetype = {
-        '.mp4': 'video/mp4',
-        '.webm': 'video/webm',
-        '.mkv': 'video/x-matroska',
-        '.avi': 'video/x-msvideo',
-        '.mov': 'video/quicktime',
-        '.flv': 'video/x-flv',
-    }.get(ext, 'application/octet-stream')
+    mimetype = MIME_TYPES.get(ext, 'application/octet-stream')
     
-    return send_from_directory(
-        str(downloads_dir),
-        filename,
-        mimetype=mimetype,
-        as_attachment=False  # Allow inline viewing
-    )
+    # FileResponse streams from disk without a worker thread per download,
+    # handles Range requests for seeking, and uses zero-copy sendfile when
+    # the ASGI server offers it. No filename is passed, so the video is
+    # served inline.
+    return FileResponse(str(file_path), media_type=mimetype)
 
 
-def run_server():
-    """Run the Flask server."""
-    print(f"Starting web server on port {config.web_server_port}")
-    print(f"Serving files from: {config.downloads_dir}")
-    app.run(
+app = Starlette(routes=[
+    Route('/', index),
+    Route('/health', health),
+    Route('/{filename}', serve_video),
+])
+
+
+async def serve():
+    """Serve the app on the current event loop (alongside the bot, or via run_server)."""
+    logger.info("Starting web server on port %s", config.web_server_port)
+    logger.info("Serving files from: %s", config.downloads_dir)
+
+    # Skip uvicorn's own StreamHandler config and send its error and access
+    # logs through the queue handler, so serving a clip never blocks the loop
+    uvicorn_logger = logging.getLogger('uvicorn')
+    uvicorn_logger.setLevel(logging.INFO)
+    uvicorn_logger.propagate = False
+    if log_handler not in uvicorn_logger.handlers:
+        uvicorn_logger.addHandler(log_handler)
+
+    server = uvicorn.Server(uvicorn.Config(
+        app,
         host='0.0.0.0',
         port=config.web_server_port,
-        debug=False
-    )
+        http='httptools',
+        log_config=None
+    ))
+    await server.serve()
+
+
+def run_server():
+    """Run the web server on its own, outside the bot process."""
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(serve())
 
 
 if __name__ == '__main__':